@@ -1,12 +1,27 @@
 import os
+import random
+import asyncio
+import base64
+import binascii
+import datetime
+import json
+import hashlib
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 import google.generativeai as genai
-from gtts import gTTS
-import tempfile
+from google.api_core import exceptions as google_exceptions
+from gtts import gTTS, gTTSError
+import requests
+from requests.adapters import HTTPAdapter
 import speech_recognition as sr
 import re
 
@@ -39,232 +54,439 @@ SUPPORTED_LANGUAGES = {
 }
 
 # ---- SCRIPT DETECTION ----
+# In priority order: any Devanagari wins over Tamil, Tamil over Gujarati.
+SCRIPT_RANGES = (
+	('hi', 0x0900, 0x097F),
+	('ta', 0x0B80, 0x0BFF),
+	('gu', 0x0A80, 0x0AFF),
+)
+
+# One compiled character class per script; each search runs in C and stops at
+# the first match, so Devanagari input returns after a handful of characters
+SCRIPT_PATTERNS = tuple(
+	(lang, re.compile(f"[{chr(start)}-{chr(end)}]")) for lang, start, end in SCRIPT_RANGES
+)
+
 def detect_script_simple(text):
-	if any('\u0900' <= c <= '\u097F' for c in text): return 'hi'
-	if any('\u0B80' <= c <= '\u0BFF' for c in text): return 'ta'
-	if any('\u0A80' <= c <= '\u0AFF' for c in text): return 'gu'
-	if any('a' <= c.lower() <= 'z' for c in text): return 'en'
+	# Pure-ASCII input (most English messages) can't contain any of the scripts
+	if text.isascii():
+		return 'en'
+	for lang, pattern in SCRIPT_PATTERNS:
+		if pattern.search(text):
+			return lang
+	# Latin script and anything unrecognised both fall back to English
 	return 'en'
 
 # ---- SMALL TALK (NO AUTO GREETING ANYMORE) ----
+SMALL_TALK_KEYWORDS = frozenset({'hello', 'hi', 'hey', 'namaste', 'vanakkam', 'kem cho'})
+
 def is_small_talk(text):
-	keywords = ['hello', 'hi', 'hey', 'namaste', 'vanakkam', 'kem cho']
-	tl = text.lower()
-	return any(p == tl.strip() for p in keywords)
+	# Only an exact greeting counts; "hi, how do I apply?" must still reach the model
+	return text.lower().strip() in SMALL_TALK_KEYWORDS
+
+SMALL_TALK_RESPONSES = {
+	'hi': "नमस्ते! मैं आपकी कैसे मदद कर सकता हूँ?",
+	'ta': "வணக்கம்! எப்படி உதவலாம்?",
+	'gu': "નમસ્તે! હું તમારી કેવી મદદ કરું?",
+	'en': "Hello! How can I assist you?"
+}
 
 def get_small_talk_response(lang):
-	responses = {
-		'hi': "नमस्ते! मैं आपकी कैसे मदद कर सकता हूँ?",
-		'ta': "வணக்கம்! எப்படி உதவலாம்?",
-		'gu': "નમસ્તે! હું તમારી કેવી મદદ કરું?",
-		'en': "Hello! How can I assist you?"
-	}
-	return responses.get(lang, responses['en'])
+	return SMALL_TALK_RESPONSES.get(lang, SMALL_TALK_RESPONSES['en'])
+
+# ---- RETRIES ----
+def backoff_delay(attempt, initial=0.2, maximum=2.0):
+	"""Exponential backoff with jitter, in seconds, before retry number attempt + 1."""
+	delay = min(maximum, initial * 2 ** attempt)
+	return delay / 2 + random.uniform(0, delay / 2)
+
+# ---- AUDIO WORKERS ----
+# gTTS and speech recognition block on network I/O for hundreds of ms; give them
+# their own pool so a burst of audio work can't starve the default executor
+AUDIO_MAX_WORKERS = int(os.getenv("AUDIO_MAX_WORKERS", "8"))
+AUDIO_EXECUTOR = ThreadPoolExecutor(max_workers=AUDIO_MAX_WORKERS, thread_name_prefix="audio")
+
+async def run_audio(func, *args):
+	return await asyncio.get_running_loop().run_in_executor(AUDIO_EXECUTOR, func, *args)
+
+# ---- TTS CACHE ----
+# gTTS does an HTTPS round-trip per call, but many replies (small talk, hardcoded
+# help responses) are byte-identical across users, so keep their mp3 bytes around.
+TTS_CACHE_SIZE = 512
+
+class LRUCache:
+	"""Minimal thread-safe LRU cache with optional TTL (TTS runs on worker threads)."""
+
+	def __init__(self, maxsize, ttl=None):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self._data = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key):
+		with self._lock:
+			entry = self._data.get(key)
+			if entry is None:
+				return None
+			value, expires_at = entry
+			if expires_at is not None and expires_at <= time.monotonic():
+				del self._data[key]
+				return None
+			self._data.move_to_end(key)
+			return value
+
+	def set(self, key, value):
+		expires_at = time.monotonic() + self.ttl if self.ttl else None
+		with self._lock:
+			self._data[key] = (value, expires_at)
+			self._data.move_to_end(key)
+			if len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+
+tts_cache = LRUCache(TTS_CACHE_SIZE)
+
+# Clips for the canned replies, filled once at startup and never evicted: the
+# voice-failure and model-fallback ones are needed exactly when traffic is bad
+fixed_tts_audio = {}
+
+def tts_cache_key(text, lang):
+	return hashlib.sha1(f"{lang}:{text}".encode()).hexdigest()
+
+def cached_tts(key):
+	audio = fixed_tts_audio.get(key)
+	return audio if audio is not None else tts_cache.get(key)
+
+# Replies waiting to be fetched from /tts, keyed the same way as tts_cache
+tts_requests = LRUCache(TTS_CACHE_SIZE)
+
+# Syntheses already running on the audio pool; /tts waits on these instead of starting over
+tts_inflight = {}
+
+def register_tts(text, lang):
+	"""Remember a reply for /tts and return the URL the client should fetch."""
+	key = tts_cache_key(text, lang)
+	tts_requests.set(key, (text, lang))
+	return f"/tts?key={key}"
+
+def start_tts(text, lang):
+	"""Like register_tts, but also starts synthesising now so the clip is ready sooner."""
+	key = tts_cache_key(text, lang)
+	if key not in tts_inflight and cached_tts(key) is None:
+		task = asyncio.create_task(run_audio(text_to_speech, text, lang))
+		tts_inflight[key] = task
+		task.add_done_callback(lambda _: tts_inflight.pop(key, None))
+	return register_tts(text, lang)
 
 # ---- TTS ----
-def text_to_speech(text, lang):
+# gTTS opens a new requests.Session (TCP + TLS handshake) for every clip; share
+# one pooled session across the audio workers so connections are kept alive
+TTS_SESSION = requests.Session()
+TTS_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=AUDIO_MAX_WORKERS))
+TTS_AUDIO_RE = re.compile(r'jQ1olc","\[\\"(.*)\\"]')
+
+# NOTE: stream() below mirrors gTTS 2.5's own and relies on the private
+# _prepare_requests(), so gtts is pinned to 2.5.x in requirements.txt. Recheck
+# this class before raising the pin; a mismatch makes every clip fail (502 on /tts).
+class PooledgTTS(gTTS):
+	"""gTTS that sends its requests over TTS_SESSION instead of a fresh session."""
+
+	def stream(self):
+		for pr in self._prepare_requests():
+			try:
+				r = TTS_SESSION.send(pr, proxies=urllib.request.getproxies(), timeout=self.timeout)
+				r.raise_for_status()
+			except requests.exceptions.HTTPError:
+				raise gTTSError(tts=self, response=r)
+			except requests.exceptions.RequestException:
+				raise gTTSError(tts=self)
+
+			# Same parsing as gTTS.stream: the mp3 comes back base64-encoded in the RPC reply
+			for line in r.iter_lines(chunk_size=1024):
+				decoded_line = line.decode("utf-8")
+				if "jQ1olc" in decoded_line:
+					audio_search = TTS_AUDIO_RE.search(decoded_line)
+					if not audio_search:
+						raise gTTSError(tts=self, response=r)
+					yield base64.b64decode(audio_search.group(1).encode("ascii"))
+
+TTS_LANG_MAP = {'hi': 'hi', 'ta': 'ta', 'gu': 'gu', 'en': 'en'}
+# Markdown characters that shouldn't be read out
+TTS_STRIP_TABLE = str.maketrans('', '', '*#[]()')
+
+def make_tts(text, lang):
+	tts_lang = TTS_LANG_MAP.get(lang, 'en')
+	# Clean text of markdown characters before TTS
+	clean_text = text.translate(TTS_STRIP_TABLE)
+	return PooledgTTS(text=clean_text, lang=tts_lang)
+
+def synthesize(text, lang):
 	try:
-		lang_map = {'hi': 'hi', 'ta': 'ta', 'gu': 'gu', 'en': 'en'}
-		tts_lang = lang_map.get(lang, 'en')
-		# Clean text of markdown characters before TTS
-		clean_text = re.sub(r'[\*\#\[\]\(\)]', '', text) 
-		tts = gTTS(text=clean_text, lang=tts_lang)
+		tts = make_tts(text, lang)
 		buf = BytesIO()
 		tts.write_to_fp(buf)
-		buf.seek(0)
-		return buf.read()
+		return buf.getvalue()
 	except Exception:
 		return None
 
+def text_to_speech(text, lang):
+	key = tts_cache_key(text, lang)
+	audio = cached_tts(key)
+	if audio is not None:
+		return audio
+	audio = synthesize(text, lang)
+	if audio is not None:
+		tts_cache.set(key, audio)
+	return audio
+
+def stream_speech(text, lang):
+	"""Yield mp3 chunks as gTTS produces them, caching the full clip at the end."""
+	chunks = []
+	for chunk in make_tts(text, lang).stream():
+		chunks.append(chunk)
+		yield chunk
+	tts_cache.set(tts_cache_key(text, lang), b"".join(chunks))
+
+def prewarm_tts_cache():
+	# Every fixed reply /chat can hand out, kept outside the LRU so streamed
+	# sentence clips can't push them out
+	fixed_replies = (
+		SMALL_TALK_RESPONSES,
+		MASTER_RESPONSE_BY_LANG,
+		VOICE_FAILURE_RESPONSES,
+		MODEL_FALLBACK_RESPONSES,
+	)
+	for lang in SUPPORTED_LANGUAGES:
+		texts = [replies[lang] for replies in fixed_replies]
+		# Answers behind the frontend's "Help: ..." buttons
+		texts.extend(HELP_RESPONSES_BY_LANG[lang].values())
+		for text in texts:
+			audio = synthesize(text, lang)
+			if audio is not None:
+				fixed_tts_audio[tts_cache_key(text, lang)] = audio
+
+# Keep references so pending startup tasks aren't garbage collected
+_background_tasks = set()
+
+@app.on_event("startup")
+async def warm_tts_cache():
+	# Fill the cache in the background so startup isn't held up by gTTS
+	task = asyncio.create_task(run_audio(prewarm_tts_cache))
+	_background_tasks.add(task)
+	task.add_done_callback(_background_tasks.discard)
+
 # ---- STT ----
-# NOTE: The STT function relies on external libraries and temporary files, which can be
-# complex in serverless environments. Ensure all dependencies (e.g., PyAudio for sr.AudioFile) 
+# NOTE: The STT function relies on external libraries which can be complex in
+# serverless environments. Ensure all dependencies (e.g., PyAudio for sr.AudioFile) 
 # are correctly installed and configured in your deployment environment.
 
+STT_LANG_MAP = {
+	'hi': 'hi-IN',
+	'ta': 'ta-IN',
+	'gu': 'gu-IN',
+	'en': 'en-US'
+}
+# Only holds configuration (thresholds, timeouts), so one instance serves every thread
+STT_RECOGNIZER = sr.Recognizer()
+
+# Smallest possible WAV file: RIFF header + fmt chunk + empty data chunk
+WAV_HEADER_SIZE = 44
+
+def decode_voice_payload(payload):
+	"""Decode base64 (optionally data-URL) WAV audio, or return None if it isn't WAV."""
+	if payload.startswith("data:"):
+		payload = payload.partition(",")[2]
+	try:
+		audio_bytes = base64.b64decode(payload, validate=True)
+	except (binascii.Error, ValueError):
+		return None
+	if len(audio_bytes) < WAV_HEADER_SIZE or audio_bytes[:4] != b"RIFF" or audio_bytes[8:12] != b"WAVE":
+		return None
+	return audio_bytes
+
+STT_MAX_ATTEMPTS = 2
+
 def speech_to_text(audio_bytes, target_lang):
-	# Using tempfile to write audio bytes to a file for speech_recognition
-	path = None
 	try:
-		with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-			f.write(audio_bytes)
-			path = f.name
-	
-		rec = sr.Recognizer()
-		with sr.AudioFile(path) as src:
-			audio = rec.record(src)
-	
-		lang_map = {
-			'hi': 'hi-IN',
-			'ta': 'ta-IN',
-			'gu': 'gu-IN',
-			'en': 'en-US'
-		}
-		text = rec.recognize_google(audio, language=lang_map.get(target_lang, 'en-US'))
-		
-		return text
-	except Exception:
-		# Log error if necessary
+		# sr.AudioFile accepts file-like objects, so the audio never touches disk
+		with sr.AudioFile(BytesIO(audio_bytes)) as src:
+			audio = STT_RECOGNIZER.record(src)
+	except (ValueError, EOFError, OSError):
+		# RIFF header but not decodable audio
 		return None
-	finally:
-		# Clean up temporary file
-		if path and os.path.exists(path):
-			os.unlink(path)
+
+	language = STT_LANG_MAP.get(target_lang, 'en-US')
+	for attempt in range(STT_MAX_ATTEMPTS):
+		try:
+			return STT_RECOGNIZER.recognize_google(audio, language=language)
+		except sr.UnknownValueError:
+			# The speech itself was unintelligible; asking again won't change that
+			return None
+		except sr.RequestError:
+			# Network or quota trouble reaching the recognizer, which may clear up
+			if attempt == STT_MAX_ATTEMPTS - 1:
+				return None
+			time.sleep(backoff_delay(attempt))
+		except Exception:
+			# Anything else (dropped connection, no FLAC converter) still gets the voice-failure reply
+			return None
 
 # ---- AI PROMPT ----
-def build_prompt(user_query, chat_history, target_lang):
-	language_name = SUPPORTED_LANGUAGES.get(target_lang, 'English')
-	
-	# =========================================================================
-	# ✅ HARDCODED SUPPORT DATA AND LOGIC
-	# =========================================================================
-	LOGIN_URL = "https://sujhaa-frontend.vercel.app/login"
-	HELPLINE = "1800110000"
-	
-	# --- Master Query Translations (from Frontend) ---
-	MASTER_PROBLEM_QUERIES = {
-		'en': "I have a problem on the portal.",
-		'hi': "पोर्टल पर मुझे एक समस्या है",
-		'ta': "போர்ட்டலில் எனக்கு ஒரு சிக்கல் உள்ளது",
-		'gu': "પોર્ટલ પર મને એક સમસ્યા છે"
-	}
-	
-	# --- English Responses ---
-	if target_lang == 'en':
-		HELP_RESPONSES = {
-			"Help: Application rejected, what next?": 
-				"* **Check Reason:** **Log in** to see the rejection reason: " + LOGIN_URL + "\n"
-				"* **Action:** **Rectify** the issue (e.g., re-upload documents) and **resubmit**.\n"
-				"* **Helpline:** Call **" + HELPLINE + "** or use the Dashboard support.",
-				
-			"Help: Forgot password or beneficiary ID": 
-				"* **Forgot Password:** Use the 'Forgot Password' link on the [**Login Page**](" + LOGIN_URL + ").\n"
-				"* **Beneficiary ID:** Check your registered **email inbox** (including spam).\n"
-				"* **Contact:** Call **" + HELPLINE + "** for further assistance.",
-				
-			"Help: Application status is stuck or not updating": 
-				"* **Wait:** Verification processes can take several weeks. Allow ample time.\n"
-				"* **Check Account:** **Log in** to your account (" + LOGIN_URL + ") to ensure no **missing document** request is pending.\n"
-				"* **Manual Check:** Call **" + HELPLINE + "** if the delay is excessive.",
-				
-			"Help: General assistance needed":
-				"* **SUJHAA Dashboard:** Use the dedicated **Help & Support** section in your dashboard.\n"
-				"* **Helpline:** Call the SUJHAA Help Desk at **" + HELPLINE + "**.",
-		}
+# =========================================================================
+# ✅ HARDCODED SUPPORT DATA AND LOGIC
+# =========================================================================
+LOGIN_URL = "https://sujhaa-frontend.vercel.app/login"
+HELPLINE = "1800110000"
+
+# --- Master Query Translations (from Frontend) ---
+MASTER_PROBLEM_QUERIES = {
+	'en': "I have a problem on the portal.",
+	'hi': "पोर्टल पर मुझे एक समस्या है",
+	'ta': "போர்ட்டலில் எனக்கு ஒரு சிக்கல் உள்ளது",
+	'gu': "પોર્ટલ પર મને એક સમસ્યા છે"
+}
+# Normalised once so matching a request is a single comparison
+MASTER_QUERY_KEYS = {lang: query.lower() for lang, query in MASTER_PROBLEM_QUERIES.items()}
+
+# --- English Responses ---
+HELP_RESPONSES_EN = {
+	"Help: Application rejected, what next?": 
+		"* **Check Reason:** **Log in** to see the rejection reason: " + LOGIN_URL + "\n"
+		"* **Action:** **Rectify** the issue (e.g., re-upload documents) and **resubmit**.\n"
+		"* **Helpline:** Call **" + HELPLINE + "** or use the Dashboard support.",
+		
+	"Help: Forgot password or beneficiary ID": 
+		"* **Forgot Password:** Use the 'Forgot Password' link on the [**Login Page**](" + LOGIN_URL + ").\n"
+		"* **Beneficiary ID:** Check your registered **email inbox** (including spam).\n"
+		"* **Contact:** Call **" + HELPLINE + "** for further assistance.",
+		
+	"Help: Application status is stuck or not updating": 
+		"* **Wait:** Verification processes can take several weeks. Allow ample time.\n"
+		"* **Check Account:** **Log in** to your account (" + LOGIN_URL + ") to ensure no **missing document** request is pending.\n"
+		"* **Manual Check:** Call **" + HELPLINE + "** if the delay is excessive.",
 		
-		# ✅ MASTER RESPONSE: Consolidated response for "I have a problem on the portal."
-		MASTER_RESPONSE = (
-			"Here is a quick guide to common SUJHAA issues:\n\n"
-			"**1. Application Rejected:**\n" + HELP_RESPONSES["Help: Application rejected, what next?"] + "\n\n"
-			"**2. Forgot Login/ID:**\n" + HELP_RESPONSES["Help: Forgot password or beneficiary ID"] + "\n\n"
-			"**3. Status Stuck/Not Updating:**\n" + HELP_RESPONSES["Help: Application status is stuck or not updating"] + "\n\n"
-			"**4. General Assistance/Other Issue:**\n" + HELP_RESPONSES["Help: General assistance needed"]
-		)
-	
-	# --- Hindi Responses ---
-	elif target_lang == 'hi':
-		HELP_RESPONSES = {
-			"Help: Application rejected, what next?":
-				"* **कारण जांचें:** **लॉग इन** करके खारिज होने का सटीक कारण देखें: " + LOGIN_URL + "\n"
-				"* **कार्य:** समस्या **ठीक करें** (दस्तावेज़ अपलोड करें) और **पुनः सबमिट** करें।\n"
-				"* **हेल्पलाइन:** SUJHAA डैशबोर्ड पर **सहायता** का उपयोग करें या **" + HELPLINE + "** पर कॉल करें।",
-				
-			"Help: Forgot password or beneficiary ID":
-				"* **पासवर्ड भूल गए:** [**लॉगिन पेज**](" + LOGIN_URL + ") पर 'पासवर्ड भूल गए' पर क्लिक करें।\n"
-				"* **लाभार्थी आईडी:** अपने पंजीकृत **ईमेल इनबॉक्स** (स्पैम सहित) की जाँच करें।\n"
-				"* **संपर्क करें:** आगे की सहायता के लिए **" + HELPLINE + "** पर कॉल करें।",
-				
-			"Help: Application status is stuck or not updating":
-				"* **प्रतीक्षा करें:** सत्यापन में कई सप्ताह लग सकते हैं।\n"
-				"* **खाता जांचें:** **लॉग इन** करें (" + LOGIN_URL + ") और सुनिश्चित करें कि कोई **दस्तावेज़ अनुरोध** लंबित नहीं है।\n"
-				"* **मैनुअल जांच:** यदि देरी अधिक है, तो **" + HELPLINE + "** पर कॉल करें।",
-				
-			"Help: General assistance needed":
-				"* **SUJHAA डैशबोर्ड:** डैशबोर्ड के अंदर उपलब्ध **सहायता एवं समर्थन** अनुभाग का उपयोग करें।\n"
-				"* **हेल्पलाइन:** SUJHAA हेल्प डेस्क को **" + HELPLINE + "** पर कॉल करें।",
-		}
+	"Help: General assistance needed":
+		"* **SUJHAA Dashboard:** Use the dedicated **Help & Support** section in your dashboard.\n"
+		"* **Helpline:** Call the SUJHAA Help Desk at **" + HELPLINE + "**.",
+}
+
+# ✅ MASTER RESPONSE: Consolidated response for "I have a problem on the portal."
+MASTER_RESPONSE_EN = (
+	"Here is a quick guide to common SUJHAA issues:\n\n"
+	"**1. Application Rejected:**\n" + HELP_RESPONSES_EN["Help: Application rejected, what next?"] + "\n\n"
+	"**2. Forgot Login/ID:**\n" + HELP_RESPONSES_EN["Help: Forgot password or beneficiary ID"] + "\n\n"
+	"**3. Status Stuck/Not Updating:**\n" + HELP_RESPONSES_EN["Help: Application status is stuck or not updating"] + "\n\n"
+	"**4. General Assistance/Other Issue:**\n" + HELP_RESPONSES_EN["Help: General assistance needed"]
+)
+
+# --- Hindi Responses ---
+HELP_RESPONSES_HI = {
+	"Help: Application rejected, what next?":
+		"* **कारण जांचें:** **लॉग इन** करके खारिज होने का सटीक कारण देखें: " + LOGIN_URL + "\n"
+		"* **कार्य:** समस्या **ठीक करें** (दस्तावेज़ अपलोड करें) और **पुनः सबमिट** करें।\n"
+		"* **हेल्पलाइन:** SUJHAA डैशबोर्ड पर **सहायता** का उपयोग करें या **" + HELPLINE + "** पर कॉल करें।",
 		
-		# ✅ MASTER RESPONSE: Consolidated response for "पोर्टल पर मुझे एक समस्या है"
-		MASTER_RESPONSE = (
-			"SUJHAA की सामान्य समस्याओं के लिए एक त्वरित मार्गदर्शिका यहाँ दी गई है:\n\n"
-			"**1. आवेदन खारिज हुआ:**\n" + HELP_RESPONSES["Help: Application rejected, what next?"] + "\n\n"
-			"**2. लॉगिन/आईडी भूल गए:**\n" + HELP_RESPONSES["Help: Forgot password or beneficiary ID"] + "\n\n"
-			"**3. स्थिति फँसी हुई/अपडेट नहीं:**\n" + HELP_RESPONSES["Help: Application status is stuck or not updating"] + "\n\n"
-			"**4. सामान्य सहायता/अन्य:**\n" + HELP_RESPONSES["Help: General assistance needed"]
-		)
-
-	# --- Tamil Responses ---
-	elif target_lang == 'ta':
-		HELP_RESPONSES = {
-			"Help: Application rejected, what next?":
-				"* **காரணத்தைச் சரிபார்க்கவும்:** நிராகரிப்புக்கான காரணத்தை அறிய **உள்நுழையவும்**: " + LOGIN_URL + "\n"
-				"* **நடவடிக்கை:** சிக்கலை **சரிசெய்து** (ஆவணத்தைப் பதிவேற்றவும்) **மீண்டும் சமர்ப்பிக்கவும்**.\n"
-				"* **உதவி எண்:** SUJHAA டாஷ்போர்டில் உள்ள **ஆதரவு** அம்சத்தைப் பயன்படுத்தவும் அல்லது **" + HELPLINE + "** என்ற எண்ணில் அழைக்கவும்.",
-				
-			"Help: Forgot password or beneficiary ID":
-				"* **மறந்த கடவுச்சொல்:** [**உள்நுழைவுப் பக்கத்திற்கு**](" + LOGIN_URL + ") சென்று 'கடவுச்சொல்லை மறந்தீர்களா?' என்பதைக் கிளிக் செய்யவும்.\n"
-				"* **பயனாளி ஐடி:** உங்கள் பதிவு செய்யப்பட்ட **மின்னஞ்சல் இன்பாக்ஸை** சரிபார்க்கவும்.\n"
-				"* **தொடர்புக்கு:** மேலதிக உதவிக்கு **" + HELPLINE + "** என்ற எண்ணில் அழைக்கவும்.",
-				
-			"Help: Application status is stuck or not updating":
-				"* **காத்திருக்கவும்:** சரிபார்ப்பு செயல்முறைகளுக்கு பல வாரங்கள் ஆகலாம்.\n"
-				"* **கணக்கைச் சரிபார்க்கவும்:** **உள்நுழையவும்** (" + LOGIN_URL + ") மற்றும் **ஆவணக் கோரிக்கை** எதுவும் நிலுவையில் இல்லை என்பதை உறுதிப்படுத்தவும்.\n"
-				"* **கைமுறைச் சரிபார்ப்பு:** காலதாமதம் அதிகமாக இருந்தால், **" + HELPLINE + "** என்ற எண்ணில் அழைக்கவும்.",
-				
-			"Help: General assistance needed":
-				"* **SUJHAA டாஷ்போர்டு:** டாஷ்போர்டில் உள்ள **உதவி மற்றும் ஆதரவு** பகுதியைப் பயன்படுத்தவும்.\n"
-				"* **உதவி எண்:** SUJHAA உதவி மையத்தை **" + HELPLINE + "** என்ற எண்ணில் அழைக்கவும்.",
-		}
+	"Help: Forgot password or beneficiary ID":
+		"* **पासवर्ड भूल गए:** [**लॉगिन पेज**](" + LOGIN_URL + ") पर 'पासवर्ड भूल गए' पर क्लिक करें।\n"
+		"* **लाभार्थी आईडी:** अपने पंजीकृत **ईमेल इनबॉक्स** (स्पैम सहित) की जाँच करें।\n"
+		"* **संपर्क करें:** आगे की सहायता के लिए **" + HELPLINE + "** पर कॉल करें।",
 		
-		# ✅ MASTER RESPONSE: Consolidated response for "போர்ட்டலில் எனக்கு ஒரு சிக்கல் உள்ளது"
-		MASTER_RESPONSE = (
-			"பொதுவான SUJHAA சிக்கல்களுக்கான விரைவான வழிகாட்டி இங்கே:\n\n"
-			"**1. விண்ணப்பம் நிராகரிப்பு:**\n" + HELP_RESPONSES["Help: Application rejected, what next?"] + "\n\n"
-			"**2. உள்நுழைவு/ஐடி மறந்துவிட்டது:**\n" + HELP_RESPONSES["Help: Forgot password or beneficiary ID"] + "\n\n"
-			"**3. நிலை மாறாமல் உள்ளது/புதுப்பிக்கவில்லை:**\n" + HELP_RESPONSES["Help: Application status is stuck or not updating"] + "\n\n"
-			"**4. பொது உதவி/மற்ற சிக்கல்:**\n" + HELP_RESPONSES["Help: General assistance needed"]
-		)
-	
-	# --- Gujarati Responses ---
-	elif target_lang == 'gu':
-		HELP_RESPONSES = {
-			"Help: Application rejected, what next?":
-				"* **કારણ તપાસો:** નામંજૂર થવાનું કારણ જોવા માટે **લોગ ઇન** કરો: " + LOGIN_URL + "\n"
-				"* **ક્રિયા:** સમસ્યાને **સુધારો** (દસ્તાવેજ અપલોડ કરો) અને **ફરીથી સબમિટ** કરો.\n"
-				"* **હેલ્પલાઇન:** SUJHAA ડેશબોર્ડ પર **સહાય** સુવિધાનો ઉપયોગ કરો અથવા **" + HELPLINE + "** પર કોલ કરો.",
-				
-			"Help: Forgot password or beneficiary ID":
-				"* **પાસવર્ડ ભૂલી ગયા:** [**લોગિન પેજ**](" + LOGIN_URL + ") પર 'પાસવર્ડ ભૂલી ગયા' પર ક્લિક કરો.\n"
-				"* **લાભાર્થી ID:** તમારા નોંધાયેલ **ઇમેઇલ ઇનબોક્સ** (સ્પામ સહિત) તપાસો.\n"
-				"* **સંપર્ક:** વધુ સહાય માટે **" + HELPLINE + "** પર કોલ કરો.",
-				
-			"Help: Application status is stuck or not updating":
-				"* **રાહ જુઓ:** ચકાસણી પ્રક્રિયાઓમાં કેટલાક અઠવાડિયા લાગી શકે છે. પૂરતો સમય આપો.\n"
-				"* **એકાઉન્ટ તપાસો:** **લોગ ઇન** કરો (" + LOGIN_URL + ") અને ખાતરી કરો કે કોઈ **દસ્તાવેજ વિનંતી** બાકી નથી.\n"
-				"* **મેન્યુઅલ તપાસ:** જો વિલંબ વધુ હોય, તો **" + HELPLINE + "** પર કોલ કરો。",
-				
-			"Help: General assistance needed":
-				"* **SUJHAA ડેશબોર્ડ:** ડેશબોર્ડની અંદર ઉપલબ્ધ **સહાય અને સમર્થન** વિભાગનો ઉપયોગ કરો.\n"
-				"* **હેલ્પલાઇન:** SUJHAA હેલ્પ ડેસ્કને **" + HELPLINE + "** પર કોલ કરો.",
-		}
+	"Help: Application status is stuck or not updating":
+		"* **प्रतीक्षा करें:** सत्यापन में कई सप्ताह लग सकते हैं।\n"
+		"* **खाता जांचें:** **लॉग इन** करें (" + LOGIN_URL + ") और सुनिश्चित करें कि कोई **दस्तावेज़ अनुरोध** लंबित नहीं है।\n"
+		"* **मैनुअल जांच:** यदि देरी अधिक है, तो **" + HELPLINE + "** पर कॉल करें।",
 		
-		# ✅ MASTER RESPONSE: Consolidated response for "પોર્ટલ પર મને એક સમસ્યા છે"
-		MASTER_RESPONSE = (
-			"સામાન્ય SUJHAA સમસ્યાઓ માટેની ઝડપી માર્ગદર્શિકા અહીં છે:\n\n"
-			"**1. અરજી નામંજૂર:**\n" + HELP_RESPONSES["Help: Application rejected, what next?"] + "\n\n"
-			"**2. લોગિન/ID ભૂલી ગયા:**\n" + HELP_RESPONSES["Help: Forgot password or beneficiary ID"] + "\n\n"
-			"**3. સ્થિતિ અટકી ગઈ/અપડેટ નથી:**\n" + HELP_RESPONSES["Help: Application status is stuck or not updating"] + "\n\n"
-			"**4. સામાન્ય સહાય/અન્ય:**\n" + HELP_RESPONSES["Help: General assistance needed"]
-		)
-	
-	# --- CRITICAL FIX: Check for hardcoded response first and return immediately if found ---
-	master_query = MASTER_PROBLEM_QUERIES.get(target_lang)
-	if master_query and user_query.strip().lower() == master_query.lower():
-		return MASTER_RESPONSE
-	
-	# =========================================================================
-	# (Continue with the original prompt for general queries)
-	# =========================================================================
-	return f"""
+	"Help: General assistance needed":
+		"* **SUJHAA डैशबोर्ड:** डैशबोर्ड के अंदर उपलब्ध **सहायता एवं समर्थन** अनुभाग का उपयोग करें।\n"
+		"* **हेल्पलाइन:** SUJHAA हेल्प डेस्क को **" + HELPLINE + "** पर कॉल करें।",
+}
+
+# ✅ MASTER RESPONSE: Consolidated response for "पोर्टल पर मुझे एक समस्या है"
+MASTER_RESPONSE_HI = (
+	"SUJHAA की सामान्य समस्याओं के लिए एक त्वरित मार्गदर्शिका यहाँ दी गई है:\n\n"
+	"**1. आवेदन खारिज हुआ:**\n" + HELP_RESPONSES_HI["Help: Application rejected, what next?"] + "\n\n"
+	"**2. लॉगिन/आईडी भूल गए:**\n" + HELP_RESPONSES_HI["Help: Forgot password or beneficiary ID"] + "\n\n"
+	"**3. स्थिति फँसी हुई/अपडेट नहीं:**\n" + HELP_RESPONSES_HI["Help: Application status is stuck or not updating"] + "\n\n"
+	"**4. सामान्य सहायता/अन्य:**\n" + HELP_RESPONSES_HI["Help: General assistance needed"]
+)
+
+# --- Tamil Responses ---
+HELP_RESPONSES_TA = {
+	"Help: Application rejected, what next?":
+		"* **காரணத்தைச் சரிபார்க்கவும்:** நிராகரிப்புக்கான காரணத்தை அறிய **உள்நுழையவும்**: " + LOGIN_URL + "\n"
+		"* **நடவடிக்கை:** சிக்கலை **சரிசெய்து** (ஆவணத்தைப் பதிவேற்றவும்) **மீண்டும் சமர்ப்பிக்கவும்**.\n"
+		"* **உதவி எண்:** SUJHAA டாஷ்போர்டில் உள்ள **ஆதரவு** அம்சத்தைப் பயன்படுத்தவும் அல்லது **" + HELPLINE + "** என்ற எண்ணில் அழைக்கவும்.",
+		
+	"Help: Forgot password or beneficiary ID":
+		"* **மறந்த கடவுச்சொல்:** [**உள்நுழைவுப் பக்கத்திற்கு**](" + LOGIN_URL + ") சென்று 'கடவுச்சொல்லை மறந்தீர்களா?' என்பதைக் கிளிக் செய்யவும்.\n"
+		"* **பயனாளி ஐடி:** உங்கள் பதிவு செய்யப்பட்ட **மின்னஞ்சல் இன்பாக்ஸை** சரிபார்க்கவும்.\n"
+		"* **தொடர்புக்கு:** மேலதிக உதவிக்கு **" + HELPLINE + "** என்ற எண்ணில் அழைக்கவும்.",
+		
+	"Help: Application status is stuck or not updating":
+		"* **காத்திருக்கவும்:** சரிபார்ப்பு செயல்முறைகளுக்கு பல வாரங்கள் ஆகலாம்.\n"
+		"* **கணக்கைச் சரிபார்க்கவும்:** **உள்நுழையவும்** (" + LOGIN_URL + ") மற்றும் **ஆவணக் கோரிக்கை** எதுவும் நிலுவையில் இல்லை என்பதை உறுதிப்படுத்தவும்.\n"
+		"* **கைமுறைச் சரிபார்ப்பு:** காலதாமதம் அதிகமாக இருந்தால், **" + HELPLINE + "** என்ற எண்ணில் அழைக்கவும்.",
+		
+	"Help: General assistance needed":
+		"* **SUJHAA டாஷ்போர்டு:** டாஷ்போர்டில் உள்ள **உதவி மற்றும் ஆதரவு** பகுதியைப் பயன்படுத்தவும்.\n"
+		"* **உதவி எண்:** SUJHAA உதவி மையத்தை **" + HELPLINE + "** என்ற எண்ணில் அழைக்கவும்.",
+}
+
+# ✅ MASTER RESPONSE: Consolidated response for "போர்ட்டலில் எனக்கு ஒரு சிக்கல் உள்ளது"
+MASTER_RESPONSE_TA = (
+	"பொதுவான SUJHAA சிக்கல்களுக்கான விரைவான வழிகாட்டி இங்கே:\n\n"
+	"**1. விண்ணப்பம் நிராகரிப்பு:**\n" + HELP_RESPONSES_TA["Help: Application rejected, what next?"] + "\n\n"
+	"**2. உள்நுழைவு/ஐடி மறந்துவிட்டது:**\n" + HELP_RESPONSES_TA["Help: Forgot password or beneficiary ID"] + "\n\n"
+	"**3. நிலை மாறாமல் உள்ளது/புதுப்பிக்கவில்லை:**\n" + HELP_RESPONSES_TA["Help: Application status is stuck or not updating"] + "\n\n"
+	"**4. பொது உதவி/மற்ற சிக்கல்:**\n" + HELP_RESPONSES_TA["Help: General assistance needed"]
+)
+
+# --- Gujarati Responses ---
+HELP_RESPONSES_GU = {
+	"Help: Application rejected, what next?":
+		"* **કારણ તપાસો:** નામંજૂર થવાનું કારણ જોવા માટે **લોગ ઇન** કરો: " + LOGIN_URL + "\n"
+		"* **ક્રિયા:** સમસ્યાને **સુધારો** (દસ્તાવેજ અપલોડ કરો) અને **ફરીથી સબમિટ** કરો.\n"
+		"* **હેલ્પલાઇન:** SUJHAA ડેશબોર્ડ પર **સહાય** સુવિધાનો ઉપયોગ કરો અથવા **" + HELPLINE + "** પર કોલ કરો.",
+		
+	"Help: Forgot password or beneficiary ID":
+		"* **પાસવર્ડ ભૂલી ગયા:** [**લોગિન પેજ**](" + LOGIN_URL + ") પર 'પાસવર્ડ ભૂલી ગયા' પર ક્લિક કરો.\n"
+		"* **લાભાર્થી ID:** તમારા નોંધાયેલ **ઇમેઇલ ઇનબોક્સ** (સ્પામ સહિત) તપાસો.\n"
+		"* **સંપર્ક:** વધુ સહાય માટે **" + HELPLINE + "** પર કોલ કરો.",
+		
+	"Help: Application status is stuck or not updating":
+		"* **રાહ જુઓ:** ચકાસણી પ્રક્રિયાઓમાં કેટલાક અઠવાડિયા લાગી શકે છે. પૂરતો સમય આપો.\n"
+		"* **એકાઉન્ટ તપાસો:** **લોગ ઇન** કરો (" + LOGIN_URL + ") અને ખાતરી કરો કે કોઈ **દસ્તાવેજ વિનંતી** બાકી નથી.\n"
+		"* **મેન્યુઅલ તપાસ:** જો વિલંબ વધુ હોય, તો **" + HELPLINE + "** પર કોલ કરો。",
+		
+	"Help: General assistance needed":
+		"* **SUJHAA ડેશબોર્ડ:** ડેશબોર્ડની અંદર ઉપલબ્ધ **સહાય અને સમર્થન** વિભાગનો ઉપયોગ કરો.\n"
+		"* **હેલ્પલાઇન:** SUJHAA હેલ્પ ડેસ્કને **" + HELPLINE + "** પર કોલ કરો.",
+}
+
+# ✅ MASTER RESPONSE: Consolidated response for "પોર્ટલ પર મને એક સમસ્યા છે"
+MASTER_RESPONSE_GU = (
+	"સામાન્ય SUJHAA સમસ્યાઓ માટેની ઝડપી માર્ગદર્શિકા અહીં છે:\n\n"
+	"**1. અરજી નામંજૂર:**\n" + HELP_RESPONSES_GU["Help: Application rejected, what next?"] + "\n\n"
+	"**2. લોગિન/ID ભૂલી ગયા:**\n" + HELP_RESPONSES_GU["Help: Forgot password or beneficiary ID"] + "\n\n"
+	"**3. સ્થિતિ અટકી ગઈ/અપડેટ નથી:**\n" + HELP_RESPONSES_GU["Help: Application status is stuck or not updating"] + "\n\n"
+	"**4. સામાન્ય સહાય/અન્ય:**\n" + HELP_RESPONSES_GU["Help: General assistance needed"]
+)
+
+HELP_RESPONSES_BY_LANG = {
+	'en': HELP_RESPONSES_EN,
+	'hi': HELP_RESPONSES_HI,
+	'ta': HELP_RESPONSES_TA,
+	'gu': HELP_RESPONSES_GU,
+}
+
+MASTER_RESPONSE_BY_LANG = {
+	'en': MASTER_RESPONSE_EN,
+	'hi': MASTER_RESPONSE_HI,
+	'ta': MASTER_RESPONSE_TA,
+	'gu': MASTER_RESPONSE_GU,
+}
+
+# --- System instruction, sent once per model rather than with every turn ---
+SYSTEM_PROMPT_TEMPLATE = """
 You are **AAROH**, a responsible, careful, and intelligent AI assistant for the **SUJHAA** platform.
 
 ━━━━━━━━━━━━━━━━━━━━
@@ -403,21 +625,177 @@ You may help with:
 3. Use **bullet points & bold keywords**
 4. No greeting unless user greets first
 5. Maintain calm, official, helpful tone
+"""
 
+# --- Per-turn prompt for general queries (filled in per request by build_prompt) ---
+PROMPT_TEMPLATE = """
 Conversation History:
 {chat_history}
 
 User Question:
 {user_query}
 
-Now respond carefully and truthfully in **{language_name}**, following ALL rules above.
+Now respond carefully and truthfully in **{language_name}**, following ALL rules in your instructions.
 """
 
+# Language name filled in once per language; only history and question vary per request
+PROMPT_TEMPLATES = {
+	lang: PROMPT_TEMPLATE.format(
+		language_name=name,
+		chat_history="{chat_history}",
+		user_query="{user_query}",
+	)
+	for lang, name in SUPPORTED_LANGUAGES.items()
+}
+
+
+def get_hardcoded_response(user_query, target_lang):
+	"""Return the canned support reply for a frontend help query, or None."""
+	help_responses = HELP_RESPONSES_BY_LANG.get(target_lang)
+	if help_responses is None:
+		return None
+	query = user_query.strip()
+	# Help buttons on the frontend send their English label, whatever the language
+	if query.startswith("Help:"):
+		return help_responses.get(query, MASTER_RESPONSE_BY_LANG[target_lang])
+	if query.lower() == MASTER_QUERY_KEYS[target_lang]:
+		return MASTER_RESPONSE_BY_LANG[target_lang]
+	return None
+
+def build_prompt(user_query, chat_history, target_lang):
+	template = PROMPT_TEMPLATES.get(target_lang, PROMPT_TEMPLATES['en'])
+	return template.format(chat_history=chat_history, user_query=user_query)
+
 
 # --- Configure Gemini Model ---
 # This assumes GOOGLE_API_KEY is correctly set in your Render environment variables
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-model = genai.GenerativeModel("gemini-2.5-flash")
+
+GEMINI_MODEL = "gemini-2.5-flash"
+
+def make_model(language_name):
+	# The static rules go in system_instruction so each turn only sends history + question
+	return genai.GenerativeModel(
+		GEMINI_MODEL,
+		system_instruction=SYSTEM_PROMPT_TEMPLATE.format(language_name=language_name),
+	)
+
+# Models are built on first use per language so startup doesn't wait on cache
+# registration round-trips for languages that may never be asked for
+MODELS = {}
+MODEL_LOCKS = {lang: asyncio.Lock() for lang in SUPPORTED_LANGUAGES}
+
+# --- Context caching for the system instructions ---
+# Registering each language's rules with Gemini's cache means they're billed and
+# processed once per TTL rather than on every request. If creation fails (e.g.
+# caching unavailable for the key), the plain model is used instead.
+PROMPT_CACHE_ENABLED = os.getenv("GEMINI_PROMPT_CACHE", "1") != "0"
+PROMPT_CACHE_TTL = datetime.timedelta(hours=1)
+PROMPT_CACHE_REFRESH_MARGIN = 10 * 60  # seconds before expiry to extend the TTL
+CACHED_PROMPTS = {}  # lang -> (CachedContent, monotonic expiry)
+
+def create_cached_model(lang):
+	cache = genai.caching.CachedContent.create(
+		model=GEMINI_MODEL,
+		display_name=f"aaroh-{lang}",
+		system_instruction=SYSTEM_PROMPT_TEMPLATE.format(language_name=SUPPORTED_LANGUAGES[lang]),
+		ttl=PROMPT_CACHE_TTL,
+	)
+	return cache, genai.GenerativeModel.from_cached_content(cached_content=cache)
+
+async def init_model(lang):
+	if PROMPT_CACHE_ENABLED:
+		try:
+			cache, model = await asyncio.to_thread(create_cached_model, lang)
+		except Exception:
+			pass
+		else:
+			CACHED_PROMPTS[lang] = (cache, time.monotonic() + PROMPT_CACHE_TTL.total_seconds())
+			return model
+	return make_model(SUPPORTED_LANGUAGES[lang])
+
+async def extend_prompt_cache(lang):
+	cache, expires_at = CACHED_PROMPTS[lang]
+	if expires_at <= time.monotonic():
+		# Already gone on Gemini's side; register a fresh one
+		del CACHED_PROMPTS[lang]
+		MODELS[lang] = await init_model(lang)
+		return
+	try:
+		await asyncio.to_thread(cache.update, ttl=PROMPT_CACHE_TTL)
+	except Exception:
+		# Can't keep it alive: go back to sending the instruction inline
+		del CACHED_PROMPTS[lang]
+		MODELS[lang] = make_model(SUPPORTED_LANGUAGES[lang])
+	else:
+		CACHED_PROMPTS[lang] = (cache, time.monotonic() + PROMPT_CACHE_TTL.total_seconds())
+
+def prompt_cache_due(lang):
+	entry = CACHED_PROMPTS.get(lang)
+	return entry is not None and entry[1] - time.monotonic() < PROMPT_CACHE_REFRESH_MARGIN
+
+async def get_model(target_lang):
+	lang = target_lang if target_lang in SUPPORTED_LANGUAGES else 'en'
+	model = MODELS.get(lang)
+	if model is not None and not prompt_cache_due(lang):
+		return model
+	# One registration per language even when a burst of requests arrives at once
+	async with MODEL_LOCKS[lang]:
+		if lang not in MODELS:
+			MODELS[lang] = await init_model(lang)
+		elif prompt_cache_due(lang):
+			await extend_prompt_cache(lang)
+		return MODELS[lang]
+
+@app.on_event("shutdown")
+async def delete_prompt_caches():
+	# Cached content is billed for storage until it expires, so don't leave it behind
+	for cache, _ in CACHED_PROMPTS.values():
+		try:
+			await asyncio.to_thread(cache.delete)
+		except Exception:
+			pass
+	CACHED_PROMPTS.clear()
+
+# Identical questions (same language, history and wording) are common for a
+# scheme helpdesk, so reuse the model's answer instead of another round-trip
+RESPONSE_CACHE_SIZE = 2048
+RESPONSE_CACHE_TTL = 3600  # seconds
+response_cache = LRUCache(RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+
+# Trailing punctuation that doesn't change the question (incl. Devanagari danda)
+QUERY_TRAILING_PUNCTUATION = "?.!।॥ "
+
+def normalize_query(user_query):
+	# "What is PM-AJAY?" and "what is  pm-ajay" should share one cache entry
+	return " ".join(user_query.casefold().split()).rstrip(QUERY_TRAILING_PUNCTUATION)
+
+def response_cache_key(target_lang, history_text, user_query):
+	return hashlib.blake2b(
+		f"{target_lang}|{history_text}|{normalize_query(user_query)}".encode(), digest_size=16
+	).hexdigest()
+
+# Transient Gemini failures worth another attempt before falling back
+GEMINI_RETRYABLE_ERRORS = (
+	google_exceptions.ResourceExhausted,
+	google_exceptions.DeadlineExceeded,
+	google_exceptions.ServiceUnavailable,
+	google_exceptions.InternalServerError,
+)
+GEMINI_MAX_ATTEMPTS = 3
+
+async def generate_with_retries(model, prompt, **kwargs):
+	for attempt in range(GEMINI_MAX_ATTEMPTS):
+		try:
+			return await model.generate_content_async(prompt, **kwargs)
+		except GEMINI_RETRYABLE_ERRORS:
+			if attempt == GEMINI_MAX_ATTEMPTS - 1:
+				raise
+			await asyncio.sleep(backoff_delay(attempt))
+
+# Cap in-flight Gemini calls so a burst queues here instead of tripping API rate limits
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_SEM = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
 
 # ========= MAIN API ============
 class ChatRequest(BaseModel):
@@ -427,64 +805,290 @@ class ChatRequest(BaseModel):
 	wants_audio: bool = False
 	is_voice: bool = False
 
-@app.post("/chat")
-async def chat(req: ChatRequest):
+VOICE_FAILURE_RESPONSES = {
+	"hi": "क्षमा करें, आपकी आवाज़ समझ नहीं आई।",
+	"ta": "மன்னிக்கவும், குரலை புரிந்துகொள்ள முடியவில்லை。",
+	"gu": "માફ કરશો, અવાજ સમજાયો નથી。",
+	"en": "Sorry, I couldn’t understand your voice."
+}
+
+MODEL_FALLBACK_RESPONSES = {
+	'hi': "अभी जानकारी उपलब्ध नहीं है। कृपया बाद में प्रयास करें।",
+	'ta': "தகவல் கிடைக்கவில்லை. பின்னர் முயற்சிக்கவும்。",
+	'gu': "માહિતી ઉપલબ્ધ નથી. થોડા સમય પછી પ્રયત્ન કરો。",
+	'en': "I cannot respond right now. Please try again later."
+}
+
+def voice_failure_response(lang):
+	return VOICE_FAILURE_RESPONSES.get(lang, VOICE_FAILURE_RESPONSES["en"])
+
+def model_fallback_response(lang):
+	return MODEL_FALLBACK_RESPONSES.get(lang, MODEL_FALLBACK_RESPONSES["en"])
+
+# Bound what each turn sends to Gemini: long pastes are clipped, and once the
+# history outgrows the budget its older turns are replaced by a one-line summary
+HISTORY_TURNS = 10
+HISTORY_MESSAGE_MAX_CHARS = 2000
+HISTORY_BUDGET_CHARS = 4000
+# The summarised block ends on a multiple of this many turns, so it stays the
+# same (and its summary stays cached) for that many follow-up requests
+HISTORY_SUMMARY_STEP = 6
+SUMMARY_MAX_CHARS = 500
+SUMMARY_CACHE_SIZE = 1024
+summary_cache = LRUCache(SUMMARY_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+# No system instruction: the helpdesk rules would only get in the way of summarising
+SUMMARY_MODEL = genai.GenerativeModel(GEMINI_MODEL)
+SUMMARY_PROMPT = (
+	"Summarise this conversation between a user and the SUJHAA helpdesk assistant "
+	"in one sentence. Keep any names, IDs, scheme details or problems the user mentioned.\n\n"
+	"{history}"
+)
+
+def clip_text(text, limit):
+	if len(text) <= limit:
+		return text
+	return text[:limit - 1] + "…"
 
+def render_turn(m):
+	# chat_history is untyped, so content may be null or a number
+	content = clip_text(str(m['content']), HISTORY_MESSAGE_MAX_CHARS)
+	return f"{'User' if m['role'] == 'user' else 'Assistant'}: {content}\n"
+
+def render_turns(turns):
+	return "".join(render_turn(m) for m in turns)
+
+def fit_history(prefix, turns):
+	"""Render turns after prefix, dropping the oldest until it fits the budget."""
+	lines = [render_turn(m) for m in turns]
+	size = len(prefix) + sum(map(len, lines))
+	# One clipped turn plus a clipped summary is always within the budget
+	while len(lines) > 1 and size > HISTORY_BUDGET_CHARS:
+		size -= len(lines.pop(0))
+	return prefix + "".join(lines)
+
+async def summarize_history(history_text):
+	key = hashlib.blake2b(history_text.encode(), digest_size=16).hexdigest()
+	summary = summary_cache.get(key)
+	if summary is None:
+		async with GEMINI_SEM:
+			resp = await generate_with_retries(SUMMARY_MODEL, SUMMARY_PROMPT.format(history=history_text))
+		summary = clip_text(resp.text.strip(), SUMMARY_MAX_CHARS)
+		summary_cache.set(key, summary)
+	return summary
+
+async def render_history(chat_history):
+	history_text = render_turns(chat_history[-HISTORY_TURNS:])
+	if len(history_text) <= HISTORY_BUDGET_CHARS:
+		return history_text
+	split = (len(chat_history) - 1) // HISTORY_SUMMARY_STEP * HISTORY_SUMMARY_STEP
+	older = chat_history[max(0, split - HISTORY_TURNS):split]
+	prefix = ""
+	if older:
+		try:
+			summary = await summarize_history(render_turns(older))
+		except Exception:
+			# Dropping the older turns still keeps the prompt within bounds
+			summary = None
+		if summary:
+			prefix = f"Summary of earlier messages: {summary}\n"
+	return fit_history(prefix, chat_history[split:])
+
+async def resolve_chat(req, target_lang):
+	"""Handle voice input and canned replies shared by /chat and /chat/stream.
+
+	Returns (user_query, ai_resp); ai_resp is None when the model has to answer.
+	"""
 	user_query = req.message
-	target_lang = req.target_language.lower()
-	ai_resp = "" # Initialize response variable
 
 	# --- 1. Handle Voice Input (STT) ---
 	if req.is_voice:
-		# Assuming user_query contains audio bytes when is_voice is True
-		user_query = speech_to_text(user_query, target_lang)
+		# user_query carries base64 WAV audio when is_voice is True; reject anything
+		# that can't be a WAV file before paying for a recognizer thread
+		audio_bytes = decode_voice_payload(user_query)
+		user_query = await run_audio(speech_to_text, audio_bytes, target_lang) if audio_bytes else None
 		if not user_query:
-			msgs = {
-				"hi": "क्षमा करें, आपकी आवाज़ समझ नहीं आई।",
-				"ta": "மன்னிக்கவும், குரலை புரிந்துகொள்ள முடியவில்லை。",
-				"gu": "માફ કરશો, અવાજ સમજાયો નથી。",
-				"en": "Sorry, I couldn’t understand your voice."
-			}
-			ai_resp = msgs.get(target_lang, msgs["en"])
-			tts_audio = text_to_speech(ai_resp, target_lang) if req.wants_audio else None
-			return {"text": ai_resp, "language": target_lang, "tts_audio": tts_audio}
-
-	# --- 2. Handle Small Talk ---
+			return None, voice_failure_response(target_lang)
+
+	# --- 2. Handle Small Talk and Hardcoded Help ---
 	if is_small_talk(user_query):
-		ai_resp = get_small_talk_response(target_lang)
-	else:
-		# --- 3. Build History and Prompt ---
-		history_text = ""
-		for m in req.chat_history[-10:]:
-			role = "User" if m["role"] == "user" else "Assistant"
-			history_text += f"{role}: {m['content']}\n"
-
-		prompt_or_response = build_prompt(user_query, history_text, target_lang)
-
-		# --- 4. Decide Hardcoded Response vs. LLM Call ---
-		# Check if build_prompt returned the short, hardcoded response (which is <= 1500 characters)
-		# instead of the long system prompt (> 1500 characters)
-		if len(prompt_or_response) < 1500 and not prompt_or_response.startswith('You are **AAROH**'):
-			ai_resp = prompt_or_response
-		else:
-			# Process through the AI model
-			try:
-				ai_resp = model.generate_content(prompt_or_response).text
-			except Exception as e:
-				# print(f"Gemini API Error: {e}") # Uncomment for debugging
-				fallback = {
-					'hi': "अभी जानकारी उपलब्ध नहीं है। कृपया बाद में प्रयास करें।",
-					'ta': "தகவல் கிடைக்கவில்லை. பின்னர் முயற்சிக்கவும்。",
-					'gu': "માહિતી ઉપલબ્ધ નથી. થોડા સમય પછી પ્રયત્ન કરો。",
-					'en': "I cannot respond right now. Please try again later."
-				}
-				ai_resp = fallback.get(target_lang, fallback["en"])
-
-	# --- 5. Generate TTS and Return ---
-	tts_audio = text_to_speech(ai_resp, target_lang) if req.wants_audio else None
+		return user_query, get_small_talk_response(target_lang)
+	return user_query, get_hardcoded_response(user_query, target_lang)
 
+def chat_payload(ai_resp, target_lang, wants_audio):
+	# Audio is streamed from /tts instead of being inlined in the JSON body
+	tts_url = register_tts(ai_resp, target_lang) if wants_audio else None
 	return {
 		"text": ai_resp,
 		"language": target_lang,
-		"tts_audio": tts_audio
-	}
\ No newline at end of file
+		"tts_url": tts_url
+	}
+
+@app.post("/chat")
+async def chat(req: ChatRequest):
+	target_lang = req.target_language.lower()
+	user_query, ai_resp = await resolve_chat(req, target_lang)
+
+	if ai_resp is None:
+		# --- 3. Build History and Check the Response Cache ---
+		history_text = await render_history(req.chat_history)
+		cache_key = response_cache_key(target_lang, history_text, user_query)
+		ai_resp = response_cache.get(cache_key)
+
+	if ai_resp is None:
+		# --- 4. Process through the AI model ---
+		prompt = build_prompt(user_query, history_text, target_lang)
+		try:
+			# Resolved before taking a slot: a cold language may wait on cache registration
+			model = await get_model(target_lang)
+			# The SDK's async client shares the event loop instead of holding a thread per chat
+			async with GEMINI_SEM:
+				resp = await generate_with_retries(model, prompt)
+			ai_resp = resp.text
+			response_cache.set(cache_key, ai_resp)
+		except Exception as e:
+			# print(f"Gemini API Error: {e}") # Uncomment for debugging
+			ai_resp = model_fallback_response(target_lang)
+
+	# --- 5. Hand out a TTS URL and Return ---
+	return chat_payload(ai_resp, target_lang, req.wants_audio)
+
+# ========= STREAMING API ============
+def sse_event(data, event=None):
+	# JSON-encode the data so newlines in model output can't break the event framing
+	message = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+	return f"event: {event}\n{message}" if event else message
+
+# Sentence ends (incl. Devanagari danda) and line breaks, where speech can be cut
+SENTENCE_BREAK_RE = re.compile(r'(?<=[.!?।])\s+|\n+')
+# Don't synthesise fragments like "1." on their own; wait for more text instead
+TTS_MIN_CLIP_CHARS = 40
+
+def split_at_last_sentence(text):
+	"""Split text into (complete sentences, unfinished remainder)."""
+	last = None
+	for last in SENTENCE_BREAK_RE.finditer(text):
+		pass
+	if last is None:
+		return "", text
+	return text[:last.start()], text[last.end():]
+
+def speech_length(text):
+	return len(text.translate(TTS_STRIP_TABLE).strip())
+
+async def stream_model(model, prompt):
+	"""Yield Gemini's reply text chunk by chunk as it is generated."""
+	# GEMINI_SEM caps calls to Gemini, not client I/O: chunks are read into a queue
+	# so the slot is released as soon as Gemini finishes, however slowly the SSE
+	# client consumes them
+	queue = asyncio.Queue()
+
+	async def read_stream():
+		try:
+			async with GEMINI_SEM:
+				# Only opening the stream is retried; a failure mid-reply can't be replayed
+				response = await generate_with_retries(model, prompt, stream=True)
+				async for chunk in response:
+					queue.put_nowait(chunk.text)
+		except Exception as e:
+			queue.put_nowait(e)
+		else:
+			queue.put_nowait(None)
+
+	reader = asyncio.create_task(read_stream())
+	try:
+		while True:
+			item = await queue.get()
+			if item is None:
+				return
+			if isinstance(item, Exception):
+				raise item
+			yield item
+	finally:
+		# Client went away mid-reply: stop generating instead of holding the slot
+		reader.cancel()
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest):
+	"""Same as /chat, but sends the reply as server-sent events while it is generated.
+
+	Each unnamed event carries {"text": <chunk>}; the final "done" event carries
+	the body /chat would have returned. With wants_audio, "audio" events carry
+	{"tts_url": ...} for consecutive pieces of the reply as soon as each piece
+	is complete, so playback can start while the rest is still being generated.
+	"""
+	target_lang = req.target_language.lower()
+	user_query, ai_resp = await resolve_chat(req, target_lang)
+	if ai_resp is None:
+		# Answers cached by either endpoint are replayed as a single event
+		history_text = await render_history(req.chat_history)
+		cache_key = response_cache_key(target_lang, history_text, user_query)
+		ai_resp = response_cache.get(cache_key)
+
+	def audio_event(text):
+		return sse_event({"tts_url": start_tts(text, target_lang)}, event="audio")
+
+	async def events():
+		if ai_resp is not None:
+			yield sse_event({"text": ai_resp})
+			if req.wants_audio:
+				yield audio_event(ai_resp)
+			yield sse_event(chat_payload(ai_resp, target_lang, req.wants_audio), event="done")
+			return
+
+		prompt = build_prompt(user_query, history_text, target_lang)
+		parts = []
+		unspoken = ""
+		try:
+			async for text in stream_model(await get_model(target_lang), prompt):
+				parts.append(text)
+				yield sse_event({"text": text})
+				if req.wants_audio:
+					# Synthesise finished sentences while Gemini generates the next ones
+					unspoken += text
+					ready, rest = split_at_last_sentence(unspoken)
+					if speech_length(ready) >= TTS_MIN_CLIP_CHARS:
+						unspoken = rest
+						yield audio_event(ready)
+			# Only a reply that streamed to completion is worth caching
+			response_cache.set(cache_key, "".join(parts))
+		except Exception:
+			# Only fall back if nothing reached the client yet; otherwise keep what was sent
+			if not parts:
+				parts.append(model_fallback_response(target_lang))
+				unspoken = parts[0]
+				yield sse_event({"text": parts[0]})
+		if req.wants_audio and speech_length(unspoken):
+			yield audio_event(unspoken)
+		yield sse_event(chat_payload("".join(parts), target_lang, req.wants_audio), event="done")
+
+	return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.get("/tts")
+async def tts(key: str):
+	synthesis = tts_inflight.get(key)
+	if synthesis is not None:
+		# Shielded so a client hanging up doesn't cancel work other requests may share
+		await asyncio.shield(synthesis)
+	audio = cached_tts(key)
+	if audio is not None:
+		return Response(content=audio, media_type="audio/mpeg")
+	pending = tts_requests.get(key)
+	if pending is None:
+		raise HTTPException(status_code=404, detail="Unknown or expired TTS key")
+	text, lang = pending
+	chunks = stream_speech(text, lang)
+	try:
+		# Pull the first chunk here so a gTTS failure is still a proper error response
+		first = await run_audio(next, chunks, None)
+	except Exception:
+		first = None
+	if first is None:
+		raise HTTPException(status_code=502, detail="Speech synthesis failed")
+
+	async def audio_chunks():
+		chunk = first
+		while chunk is not None:
+			yield chunk
+			chunk = await run_audio(next, chunks, None)
+
+	return StreamingResponse(audio_chunks(), media_type="audio/mpeg")